@@ -5,19 +5,17 @@ import asyncio
 import os
 import signal
 import sys
-import numpy as np
-from vpython import box, vector, rate, scene
-import math
-import pyvista as pv
-from pyvista import examples
-from scipy.spatial.transform import Rotation as R
 
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
-from lib_gforce import gforce
+from band.lib_gforce import gforce
+from band.band_controller import sample_quaternion
+
+# Only every n-th sample is printed, printing all of them slows the loop down
+PRINT_EVERY = 64
 
 
 class Application:
@@ -32,6 +30,9 @@ class Application:
 
 
     async def main(self):
+        # vpython is only needed once the visualisation actually runs
+        from vpython import box, vector
+
         gforce_device = gforce.GForce()
 
         await gforce_device.connect()
@@ -41,11 +42,16 @@ class Application:
         imu_box = box(pos=vector(0,0,0), length=2, height=0.5, width=1, color=vector(1,0,0))
 
         def update_orientation(orientation_data):
-            # Assuming orientation_data is a quaternion or Euler angles (roll, pitch, yaw)
-            # Replace with the code to transform these angles into the correct orientation
-            # Example for Euler angles:
-            roll, pitch, yaw = orientation_data
-            imu_box.axis = vector(np.cos(yaw), np.sin(pitch), np.sin(roll))
+            # orientation_data is a quaternion or a (pitch, roll, yaw) degrees row,
+            # read the same way band_controller reads it
+            q0, q1, q2, q3 = sample_quaternion(orientation_data)
+            # The box's local x-axis is the first column of the rotation matrix
+            # R = (q0^2 - |q|^2) I + 2 q q^T + 2 q0 [q]x
+            imu_box.axis = vector(
+                q0 * q0 + q1 * q1 - q2 * q2 - q3 * q3,
+                2 * (q1 * q2 + q0 * q3),
+                2 * (q1 * q3 - q0 * q2),
+            )
 
         await gforce_device.set_motor(True)
         await asyncio.sleep(2)
@@ -58,18 +64,31 @@ class Application:
 
         q = await gforce_device.start_streaming()
 
-        while not self.terminated:
-            v = await q.get()
-            print(v)
-
-            # Fetch orientation data from your IMU
-            orientation_data = v[0]  # Replace with actual data fetching
-    
-            # Update the orientation of the box
-            update_orientation(list(map(math.radians, orientation_data)))
-            
-            # Control the refresh rate
-            rate(60)  # Adjust for your preferred frame rate
+        # Ingest and render run side by side so neither paces the other
+        latest = gforce.LatestValue()
+
+        async def ingest():
+            i = 0
+            while not self.terminated:
+                v = await q.get()
+                if i % PRINT_EVERY == 0:
+                    print(v)
+                i += 1
+
+                # Fetch orientation data from your IMU
+                latest.put(v[0])
+
+        async def render():
+            while not self.terminated:
+                orientation_data = latest.snapshot()
+                if orientation_data is not None:
+                    # Update the orientation of the box
+                    update_orientation(orientation_data)
+
+                # Control the refresh rate
+                await asyncio.sleep(1 / 60)  # Adjust for your preferred frame rate
+
+        await asyncio.gather(ingest(), render())
 
         await gforce_device.stop_streaming()
         await gforce_device.disconnect()
@@ -6,7 +6,6 @@ import os
 import signal
 import sys
 import numpy as np
-import numpy as np
 import math
 
 
@@ -16,52 +15,122 @@ sys.path.append(parent_dir)
 
 from band.lib_gforce import gforce
 
+# The band streams EULERANGLE rows as (pitch, roll, yaw) in degrees
+EULER_ROW_ORDER = ("pitch", "roll", "yaw")
+
+
+def _half_angle_sin_cos(theta, _sin=math.sin, _cos=math.cos):
+    # Taylor expansion for small angles keeps sin(theta/2) accurate near zero.
+    # math.sin/math.cos are bound as defaults to skip the attribute lookups per frame.
+    if abs(theta) < 1e-4:
+        return theta / 2 - theta ** 3 / 48, 1 - theta * theta / 8
+    half = theta / 2
+    return _sin(half), _cos(half)
+
+
+def euler_to_quat(roll, pitch, yaw):
+    # ZYX (yaw, pitch, roll) Euler angles in radians to a unit quaternion (w, x, y, z)
+    sr, cr = _half_angle_sin_cos(roll)
+    sp, cp = _half_angle_sin_cos(pitch)
+    sy, cy = _half_angle_sin_cos(yaw)
+    return (
+        cr * cp * cy + sr * sp * sy,
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy,
+    )
+
+
+def quat_conj(q):
+    return (q[0], -q[1], -q[2], -q[3])
+
+
+def quat_mul(p, q):
+    # Hamilton product p * q
+    p0, p1, p2, p3 = p
+    q0, q1, q2, q3 = q
+    return (
+        p0 * q0 - p1 * q1 - p2 * q2 - p3 * q3,
+        p0 * q1 + p1 * q0 + p2 * q3 - p3 * q2,
+        p0 * q2 - p1 * q3 + p2 * q0 + p3 * q1,
+        p0 * q3 + p1 * q2 - p2 * q1 + p3 * q0,
+    )
+
+
+def sample_quaternion(sample):
+    # Unit quaternion from a quaternion or an EULER_ROW_ORDER degrees sample, None otherwise
+    if len(sample) == 4:
+        return tuple(sample.tolist())
+    if len(sample) == 3:
+        pitch, roll, yaw = np.radians(sample).tolist()
+        return euler_to_quat(roll, pitch, yaw)
+    return None
+
+
+# Gesture thresholds in degrees for negative and positive rotations about (pitch, roll, yaw),
+# stored as 2 * sin(angle / 2) to compare directly against the vector part of a quaternion
+_LOWER_THRESHOLDS = 2 * np.sin(np.radians(np.array([40, 20, 20], dtype=np.float32)) / 2)
+_UPPER_THRESHOLDS = 2 * np.sin(np.radians(np.array([40, 40, 20], dtype=np.float32)) / 2)
+# Command for a negative / positive rotation about each axis
+_AXIS_COMMANDS = (("back", "forward"), ("finish", "finish"), ("right", "left"))
+
+_delta = np.empty(3, dtype=np.float32)
+_excess = np.empty(3, dtype=np.float32)
+
+
+def classify_rotation(q_now, q_start):
+    # Rotation from the start pose to now, in the start pose's frame. Its vector part,
+    # doubled, is the rotation about each axis to first order and has no Euler wraparound.
+    w, x, y, z = quat_mul(quat_conj(q_start), q_now)
+    if w < 0:
+        # Same rotation, take the short way round
+        x, y, z = -x, -y, -z
+    _delta[0] = 2 * y
+    _delta[1] = 2 * x
+    _delta[2] = 2 * z
+
+    # Pick the axis that moved furthest past its threshold, None if none did
+    np.abs(_delta, out=_excess)
+    np.subtract(_excess, np.where(_delta > 0, _UPPER_THRESHOLDS, _LOWER_THRESHOLDS), out=_excess)
+    axis = int(np.argmax(_excess))
+    if _excess[axis] <= 0:
+        return None
+    return _AXIS_COMMANDS[axis][int(_delta[axis] > 0)]
+
+
+async def wait_for_start_pose(q):
+    # The first orientation sample on the stream is the reference for all later gestures
+    while True:
+        q_start = sample_quaternion((await q.get())[0])
+        if q_start is not None:
+            return q_start
+
 
 class SensorBand:
 
     def __init__(self):
         signal.signal(signal.SIGINT, lambda signal, frame: self._signal_handler())
         self.terminated = False
-        self.started = 0
-        self.start_roll = 0
-        self.start_pitch = 0
-        self.start_yaw = 0
+        self.start_quat = None
+        self._last_cmd = None
 
     def _signal_handler(self):
         print("You pressed ctrl-c, exit")
         self.terminated = True
 
     async def get_cmd(self):
+        # The stream only keeps the latest sample, so this never returns a stale one
         v = await self.q.get()
 
-        #with self.q.mutex:
-        #    self.q.clear()
-        
-        if len(v[0]) == 3:
-            # Fetch orientation data from your IMU
-            orientation_data = v[0]  # Replace with actual data fetching
-            if self.started == 0:
-                self.start_roll = orientation_data[1]
-                self.start_pitch = orientation_data[0]
-                self.start_yaw = orientation_data[2]
-                self.started = 1
-            # if (orientation_data[1] - start_roll) < -20:
-            #     print("right")
-            # elif (orientation_data[1] - start_roll) > 40:
-            #     print("left")
-            if (orientation_data[0] - self.start_pitch) < -40:
-                print("back")
-                return "back"
-            elif (orientation_data[0] - self.start_pitch) > 40:
-                print("forward")
-                return "forward"
-            if (orientation_data[2] - self.start_yaw) < -20:
-                print("right")
-                return "right"
-            elif (orientation_data[2] - self.start_yaw) > 20:
-                print("left")
-                return "left"
-            # print("orientation: ", orientation_data)
+        q_now = sample_quaternion(v[0])
+        if q_now is not None:
+            cmd = classify_rotation(q_now, self.start_quat)
+            if cmd != self._last_cmd:
+                # Only report changes, a held gesture would otherwise print every sample
+                if cmd is not None:
+                    print(cmd)
+                self._last_cmd = cmd
+            return cmd
 
     async def start(self):
         self.gforce_device = gforce.GForce()
@@ -79,12 +148,26 @@ class SensorBand:
         )        
         
         self.q = await self.gforce_device.start_streaming()
+        self.start_quat = await wait_for_start_pose(self.q)
 
     async def stop(self):
         await self.gforce_device.stop_streaming()
         await self.gforce_device.disconnect()
 
 
+async def main():
+    # Poll commands on a single event loop, get_cmd prints when the command changes
+    band = SensorBand()
+    await band.start()
+    try:
+        while not band.terminated:
+            try:
+                await asyncio.wait_for(band.get_cmd(), timeout=0.6)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await band.stop()
+
+
 if __name__ == "__main__":
-    app = SensorBand()
-    asyncio.run(app.start())
+    asyncio.run(main())
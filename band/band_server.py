@@ -5,28 +5,85 @@ import asyncio
 import os
 import signal
 import sys
-import numpy as np
 #from vpython import box, vector, rate, scene
-import numpy as np
-import math
-import socket
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
 from band.lib_gforce import gforce
+from band.band_controller import classify_rotation, sample_quaternion, wait_for_start_pose
+
+# Requests and replies are framed as one length byte followed by that many bytes
+GET_CMD = b"get_cmd"
+
+
+def encode_frame(payload):
+    return bytes([len(payload)]) + payload
+
+
+async def read_frame(reader):
+    n = (await reader.readexactly(1))[0]
+    return await reader.readexactly(n)
+
+
+def write_frame(writer, payload):
+    writer.write(encode_frame(payload))
+
+
+def read_frame_blocking(stream):
+    # Same as read_frame for a blocking binary stream, e.g. socket.makefile('rb')
+    header = stream.read(1)
+    payload = stream.read(header[0]) if header else b''
+    if not header or len(payload) < header[0]:
+        raise ConnectionError("band server closed the connection")
+    return payload
+
 
 class Application:
 
     def __init__(self):
         signal.signal(signal.SIGINT, lambda signal, frame: self._signal_handler())
         self.terminated = False
+        self.start_quat = None
+        self._latest = "none"
 
     def _signal_handler(self):
         print("You pressed ctrl-c, exit")
         self.terminated = True
 
+    async def _consume(self, q):
+        # Classify every sample as it arrives so requests only read the latest result
+        while not self.terminated:
+            v = await q.get()
+            q_now = sample_quaternion(v[0])
+            if q_now is None:
+                continue
+            cmd = classify_rotation(q_now, self.start_quat)
+            msg = "none" if cmd is None else cmd
+            if msg != self._latest:
+                print(msg)
+                self._latest = msg
+            if cmd == "finish":
+                break
+
+    async def _handle_client(self, reader, writer):
+        print("Connection from: " + str(writer.get_extra_info("peername")))
+        try:
+            while not self.terminated:
+                data = await read_frame(reader)
+                if data != GET_CMD:
+                    continue
+                msg = self._latest
+
+                write_frame(writer, msg.encode())  # send data to the client
+                await writer.drain()
+                if msg == "finish":
+                    self.terminated = True
+        except asyncio.IncompleteReadError:
+            print("Client disconnected")
+        finally:
+            writer.close()
 
     async def main(self):
         gforce_device = gforce.GForce()
@@ -44,75 +101,22 @@ class Application:
         )        
         
         q = await gforce_device.start_streaming()
+        self.start_quat = await wait_for_start_pose(q)
 
-        started = 0
-        start_roll = 0
-        start_pitch = 0
-        start_yaw = 0
-
-        # get the hostname
         host = ''
         port = 5000  # initiate port no above 1024
 
-        server_socket = socket.socket()  # get instance
-        # look closely. The bind() function takes tuple as argument
-        server_socket.bind((host, port))  # bind host address and port together
-
-        # configure how many client the server can listen simultaneously
-        server_socket.listen(2)
+        consumer = asyncio.create_task(self._consume(q))
+        server = await asyncio.start_server(self._handle_client, host, port)
         print("Waiting for connections...")
-        conn, address = server_socket.accept()  # accept new connection
-        print("Connection from: " + str(address))
 
-        while not self.terminated:
-            # receive data stream. it won't accept data packet greater than 1024 bytes
-            data = conn.recv(1024).decode()
-            if not data:
-                continue
-            print("from connected user: " + str(data))
-            if str(data) == "get_cmd":
-                print("true")
-                msg = "none"
-                
-                v = await q.get()
-                while not q.empty():
-                    v = await q.get()
-
-                print(f"Got: {v}")
-                if len(v[0]) == 3:
-                    # Fetch orientation data from your IMU
-                    orientation_data = v[0]  # Replace with actual data fetching
-                    if started == 0:
-                        start_roll = orientation_data[1]
-                        start_pitch = orientation_data[0]
-                        start_yaw = orientation_data[2]
-                        started = 1
-                    if (orientation_data[1] - start_roll) < -20:
-                        print("finish")
-                        break
-                    elif (orientation_data[1] - start_roll) > 40:
-                        print("finish")
-                        break
-                    else:
-                        if (orientation_data[0] - start_pitch) < -40:
-                            print("back")
-                            msg = "back"
-                        elif (orientation_data[0] - start_pitch) > 40:
-                            print("forward")
-                            msg = "forward"
-                        elif (orientation_data[2] - start_yaw) < -20:
-                            print("right")
-                            msg = "right"
-                        elif (orientation_data[2] - start_yaw) > 20:
-                            print("left")
-                            msg = "left"
-                    # print("orientation: ", orientation_data)
-                
-                conn.send(msg.encode())  # send data to the client
+        async with server:
+            while not self.terminated:
+                await asyncio.sleep(0.1)
+        consumer.cancel()
 
         await gforce_device.stop_streaming()
         await gforce_device.disconnect()
-        conn.close()
 
 
 if __name__ == "__main__":
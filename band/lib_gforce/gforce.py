@@ -1,6 +1,6 @@
 import asyncio
 import struct
-from asyncio import Queue, LifoQueue
+from asyncio import Queue
 from contextlib import suppress
 from dataclasses import dataclass
 from enum import IntEnum
@@ -205,6 +205,26 @@ class ResponseCode(IntEnum):
     PARTIAL_PACKET = 0xFF
 
 
+# Single slot holding the most recent sample, a new sample overwrites an unread one
+class LatestValue:
+    def __init__(self):
+        self._value = None
+        self._event = asyncio.Event()
+
+    def put(self, value):
+        self._value = value
+        self._event.set()
+
+    async def get(self):
+        await self._event.wait()
+        self._event.clear()
+        return self._value
+
+    def snapshot(self):
+        # Latest value without waiting for a new one, None before the first put
+        return self._value
+
+
 @dataclass
 class Response:
     code: ResponseCode
@@ -259,7 +279,7 @@ class GForce:
             self._on_cmd_response,
         )
 
-    def _on_data_response(self, q: Queue, bs: bytearray):
+    def _on_data_response(self, q: LatestValue, bs: bytearray):
         bs = bytes(bs)
         full_packet = []
 
@@ -327,7 +347,7 @@ class GForce:
                     f"Unknown data type {data_type}, full packet: {full_packet}"
                 )
 
-        q.put_nowait(data)
+        q.put(data)
 
     def _convert_emg_to_raw(self, data: bytes) -> np.ndarray[np.integer]:
         match self.resolution:
@@ -643,8 +663,8 @@ class GForce:
             )
         )
 
-    async def start_streaming(self) -> Queue:
-        q = LifoQueue()
+    async def start_streaming(self) -> LatestValue:
+        q = LatestValue()
         await self.client.start_notify(
             DATA_NOTIFY_CHAR_UUID,
             lambda _, data: self._on_data_response(q, data),
@@ -7,8 +7,6 @@ import signal
 import sys
 import numpy as np
 #from vpython import box, vector, rate, scene
-import numpy as np
-import math
 
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
@@ -16,30 +14,91 @@ parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
 from band.lib_gforce import gforce
+from band.band_controller import classify_rotation, sample_quaternion, wait_for_start_pose
 
 
-def convert_raw_emg_to_uv(
-    data: bytes, resolution: gforce.SampleResolution
-) -> np.ndarray[np.float32]:
-    min_voltage = -1.25  # volt
-    max_voltage = 1.25  # volt
-
-    match resolution:
-        case gforce.SampleResolution.BITS_8:
-            div = 127.0
-            sub = 128
-        case gforce.SampleResolution.BITS_12:
-            div = 2047.0
-            sub = 2048
-        case _:
-            raise Exception(f"Unsupported resolution {resolution}")
+try:
+    from numba import njit
+except ImportError:  # numba is optional, fall back to numpy ufuncs
+    njit = None
+
+# (max_voltage - min_voltage) / gain / div, with a +/-1.25 V range and a gain of 1200
+CONV_8 = 2.5 / 1200.0 / 127.0
+CONV_12 = 2.5 / 1200.0 / 2047.0
+EMG_NUM_CHANNELS = 8
+# 12-bit samples come off the band as little-endian 16-bit words
+_EMG_RAW_DTYPES = {
+    gforce.SampleResolution.BITS_8: np.uint8,
+    gforce.SampleResolution.BITS_12: np.dtype("<u2"),
+}
+
+if njit is not None:
+
+    @njit(cache=True, fastmath=True)
+    def _emg_u8_to_uv(buf, out):
+        for i in range(buf.size):
+            out[i] = (np.float32(buf[i]) - 128.0) * CONV_8
+
+    @njit(cache=True, fastmath=True)
+    def _emg_u12_to_uv(buf, out):
+        for i in range(buf.size):
+            out[i] = (np.float32(buf[i]) - 2048.0) * CONV_12
 
-    gain = 1200.0
-    conversion_factor = (max_voltage - min_voltage) / gain / div
+else:
 
-    emg_data = (data.astype(np.float32) - sub) * conversion_factor
+    def _emg_u8_to_uv(buf, out):
+        np.subtract(buf, 128, out=out, dtype=np.float32)
+        np.multiply(out, CONV_8, out=out)
 
-    return emg_data.reshape(-1, len(data))
+    def _emg_u12_to_uv(buf, out):
+        np.subtract(buf, 2048, out=out, dtype=np.float32)
+        np.multiply(out, CONV_12, out=out)
+
+
+# Output buffer reused across packets when the caller does not pass one
+_emg_out = None
+
+
+def convert_raw_emg_to_uv(
+    data: np.ndarray | bytes, resolution: gforce.SampleResolution, out: np.ndarray | None = None
+) -> np.ndarray[np.float32]:
+    # data is either the raw array from the stream or the packet bytes, which are viewed
+    # in place. out is a float32 buffer with the same size as data. When it is omitted a
+    # module-level buffer is reused, so the result is only valid until the next call.
+    global _emg_out
+    if not isinstance(data, np.ndarray):
+        if resolution not in _EMG_RAW_DTYPES:
+            raise Exception(f"Unsupported resolution {resolution}")
+        data = np.frombuffer(data, dtype=_EMG_RAW_DTYPES[resolution])
+    if out is None:
+        if _emg_out is None or _emg_out.size != data.size:
+            _emg_out = np.empty(data.size, dtype=np.float32)
+        out = _emg_out
+    elif out.dtype != np.float32 or out.size != data.size or not out.flags.c_contiguous:
+        # The kernels write out in place without bounds checks
+        raise ValueError(
+            f"out must be a contiguous float32 array of size {data.size}, "
+            f"got {out.dtype} of size {out.size}"
+        )
+
+    src = data.reshape(-1)
+    dst = out.reshape(-1)
+
+    if resolution == gforce.SampleResolution.BITS_8:
+        _emg_u8_to_uv(src, dst)
+    elif resolution == gforce.SampleResolution.BITS_12:
+        _emg_u12_to_uv(src, dst)
+    else:
+        raise Exception(f"Unsupported resolution {resolution}")
+
+    return dst.reshape(-1, EMG_NUM_CHANNELS)
+
+
+def emg_pair_activity(emg_data: np.ndarray) -> float:
+    # Sum over the packet of |channel 1 - channel 0|, one row per sample
+    diff = emg_data[:, 1] - emg_data[:, 0]
+    np.abs(diff, out=diff)
+    return float(diff.sum())
 
 
 class Application:
@@ -86,10 +145,8 @@ class Application:
         q = await gforce_device.start_streaming()
         # q2 = await gforce_device.start_streaming()
 
-        started = 0
-        start_roll = 0
-        start_pitch = 0
-        start_yaw = 0
+        start_quat = await wait_for_start_pose(q)
+        last_cmd = None
 
         while not self.terminated:
             v = await q.get()
@@ -99,36 +156,21 @@ class Application:
             # print(v)
             # print(v2)
 
-            if len(v[0]) == 3:
-                # Fetch orientation data from your IMU
-                orientation_data = v[0]  # Replace with actual data fetching
-                # print(orientation_data)
-                # continue
-                if started == 0:
-                    start_roll = orientation_data[1]
-                    start_pitch = orientation_data[0]
-                    start_yaw = orientation_data[2]
-                    started = 1
-                if (orientation_data[1] - start_roll) < -20:
-                    print("finish")
-                    break
-                elif (orientation_data[1] - start_roll) > 40:
-                    print("finish")
+            # Fetch orientation data from your IMU
+            q_now = sample_quaternion(v[0])
+            if q_now is not None:
+                cmd = classify_rotation(q_now, start_quat)
+                if cmd != last_cmd:
+                    # Only print changes, a held gesture would otherwise print every sample
+                    if cmd is not None:
+                        print(cmd)
+                    last_cmd = cmd
+                if cmd == "finish":
                     break
-                else:
-                    if (orientation_data[0] - start_pitch) < -40:
-                        print("back")
-                    elif (orientation_data[0] - start_pitch) > 40:
-                        print("forward")
-                    if (orientation_data[2] - start_yaw) < -20:
-                        print("right")
-                    elif (orientation_data[2] - start_yaw) > 20:
-                        print("left")
-                # print("orientation: ", orientation_data)
+                # print("orientation: ", v[0])
             else:
                 # emg_data = convert_raw_emg_to_uv(v, gforce_device.resolution)
-                # ddp = [abs(i[1] - i[0]) for i in emg_data]
-                # print("emg: ", sum(ddp))
+                # print("emg: ", emg_pair_activity(emg_data))
                 pass
     
             # Update the orientation of the box
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# band/ is not a package, so put the repo root on the path for the band.* imports,
+# the same way the band scripts do. This lets plain pytest run from any directory.
+current_dir = os.path.dirname(os.path.realpath(__file__))
+repo_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(repo_dir)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from band.band_controller import classify_rotation, sample_quaternion
+
+
+def _quat(pitch=0.0, roll=0.0, yaw=0.0):
+    # Quaternion for a band EULERANGLE row, (pitch, roll, yaw) in degrees
+    return sample_quaternion(np.array([pitch, roll, yaw], dtype=np.float32))
+
+
+START = _quat()
+
+
+@pytest.mark.parametrize(
+    "pitch, expected",
+    [(41, "forward"), (-41, "back"), (39, None), (-39, None)],
+)
+def test_pitch_threshold(pitch, expected):
+    assert classify_rotation(_quat(pitch=pitch), START) == expected
+
+
+@pytest.mark.parametrize(
+    "yaw, expected",
+    [(21, "left"), (-21, "right"), (19, None), (-19, None)],
+)
+def test_yaw_threshold(yaw, expected):
+    assert classify_rotation(_quat(yaw=yaw), START) == expected
+
+
+@pytest.mark.parametrize(
+    "roll, expected",
+    [(-21, "finish"), (41, "finish"), (-19, None), (39, None)],
+)
+def test_roll_finish_limits(roll, expected):
+    assert classify_rotation(_quat(roll=roll), START) == expected
+
+
+@pytest.mark.parametrize(
+    "yaw_start, yaw_now, expected",
+    [(170, -168, "left"), (-170, 168, "right"), (175, -175, None)],
+)
+def test_yaw_wraps_at_180(yaw_start, yaw_now, expected):
+    assert classify_rotation(_quat(yaw=yaw_now), _quat(yaw=yaw_start)) == expected
+
+
+def test_rotation_is_relative_to_start_pose():
+    q_start = _quat(pitch=30, yaw=-50)
+    assert classify_rotation(q_start, q_start) is None
+
+
+def test_quaternion_sample_is_used_as_is():
+    sample = np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
+    assert sample_quaternion(sample) == (1.0, 0.0, 0.0, 0.0)
+    assert sample_quaternion(np.zeros(2, dtype=np.float32)) is None
@@ -0,0 +1,103 @@
+import importlib
+import sys
+
+import numpy as np
+import pytest
+
+from band import robot_control
+from band.lib_gforce import gforce
+
+
+def _old_formula(data, sub, div):
+    # The per-packet conversion robot_control used before the kernels
+    return (data.astype(np.float32) - sub) * (2.5 / 1200 / div)
+
+
+@pytest.fixture
+def numpy_fallback(monkeypatch):
+    # Reload with numba hidden so the numpy ufunc kernels are picked
+    monkeypatch.setitem(sys.modules, "numba", None)
+    module = importlib.reload(robot_control)
+    assert module.njit is None
+    yield module
+    monkeypatch.undo()
+    importlib.reload(robot_control)
+
+
+@pytest.fixture(params=["default", "numpy"])
+def rc(request):
+    if request.param == "numpy":
+        return request.getfixturevalue("numpy_fallback")
+    return robot_control
+
+
+def test_8_bit_matches_old_formula(rc):
+    data = np.arange(256, dtype=np.uint8).repeat(2)
+    result = rc.convert_raw_emg_to_uv(data, gforce.SampleResolution.BITS_8)
+    np.testing.assert_allclose(result.reshape(-1), _old_formula(data, 128, 127), rtol=1e-6)
+
+
+def test_12_bit_matches_old_formula(rc):
+    data = np.arange(0, 4096, 8, dtype=np.uint16)
+    result = rc.convert_raw_emg_to_uv(data, gforce.SampleResolution.BITS_12)
+    np.testing.assert_allclose(result.reshape(-1), _old_formula(data, 2048, 2047), rtol=1e-6)
+
+
+def test_output_has_one_row_per_sample(rc):
+    data = np.full(16 * rc.EMG_NUM_CHANNELS, 128, dtype=np.uint8)
+    result = rc.convert_raw_emg_to_uv(data, gforce.SampleResolution.BITS_8)
+    assert result.shape == (16, rc.EMG_NUM_CHANNELS)
+    assert result.dtype == np.float32
+    assert not result.any()
+
+
+def test_bytes_input(rc):
+    data = np.arange(0, 4096, 256, dtype="<u2")
+    result = rc.convert_raw_emg_to_uv(data.tobytes(), gforce.SampleResolution.BITS_12)
+    np.testing.assert_allclose(result.reshape(-1), _old_formula(data, 2048, 2047), rtol=1e-6)
+
+
+def test_caller_buffer_is_filled(rc):
+    data = np.arange(8, dtype=np.uint8)
+    out = np.empty(8, dtype=np.float32)
+    result = rc.convert_raw_emg_to_uv(data, gforce.SampleResolution.BITS_8, out=out)
+    assert np.shares_memory(result, out)
+    np.testing.assert_allclose(out, _old_formula(data, 128, 127), rtol=1e-6)
+
+
+def test_unsupported_resolution(rc):
+    with pytest.raises(Exception, match="Unsupported resolution"):
+        rc.convert_raw_emg_to_uv(b"\x00" * 8, 16)
+
+
+@pytest.mark.parametrize(
+    "out",
+    [
+        np.zeros(4, dtype=np.float32),
+        np.zeros(16, dtype=np.float64),
+        np.zeros(32, dtype=np.float32)[::2],
+    ],
+    ids=["short", "float64", "strided"],
+)
+def test_bad_caller_buffer_is_rejected(rc, out):
+    data = np.full(16, 200, dtype=np.uint8)
+    before = out.copy()
+    with pytest.raises(ValueError, match="out must be"):
+        rc.convert_raw_emg_to_uv(data, gforce.SampleResolution.BITS_8, out=out)
+    np.testing.assert_array_equal(out, before)
+
+
+def test_emg_pair_activity():
+    emg = np.zeros((3, robot_control.EMG_NUM_CHANNELS), dtype=np.float32)
+    emg[:, 0] = [1.0, -2.0, 0.5]
+    emg[:, 1] = [3.0, 1.0, 0.5]
+    emg[:, 2:] = 100.0  # other channels do not count
+    activity = robot_control.emg_pair_activity(emg)
+    assert isinstance(activity, float)
+    assert activity == pytest.approx(2.0 + 3.0 + 0.0)
+
+
+def test_emg_pair_activity_of_silent_packet():
+    data = np.full(4 * robot_control.EMG_NUM_CHANNELS, 128, dtype=np.uint8)
+    emg = robot_control.convert_raw_emg_to_uv(data, gforce.SampleResolution.BITS_8)
+    assert robot_control.emg_pair_activity(emg) == 0.0
@@ -1,24 +1,22 @@
-from band.band_controller import SensorBand
+from band.band_server import GET_CMD, read_frame, write_frame
 import asyncio
-import threading
-import time
-import socket
 
-def main():
-    s = socket.socket()
-    port = 5000
-    s.connect(('127.0.0.1', port))
 
-    def getcommandfromserver():
-        s.send("get_cmd".encode())
-        msg = s.recv(1024).decode()
-        return msg
+async def main():
+    reader, writer = await asyncio.open_connection('127.0.0.1', 5000)
+
+    async def getcommandfromserver():
+        write_frame(writer, GET_CMD)
+        await writer.drain()
+        msg = await read_frame(reader)
+        return msg.decode()
 
     while True:
         
-        command = getcommandfromserver()
+        command = await getcommandfromserver()
         print(command)
 
-        time.sleep(0.2)
+        # The server answers straight away, so poll at a fixed pace
+        await asyncio.sleep(0.2)
 
-main()
\ No newline at end of file
+asyncio.run(main())
@@ -27,6 +27,7 @@ from bosdyn.client.time_sync import TimeSyncError
 from bosdyn.util import duration_str, format_metric, secs_to_hms
 
 from band.band_controller import SensorBand
+from band.band_server import GET_CMD, encode_frame, read_frame_blocking
 
 LOGGER = logging.getLogger()
 
@@ -34,6 +35,29 @@ VELOCITY_BASE_SPEED = 0.6  # m/s
 VELOCITY_BASE_ANGULAR = 0.5  # rad/sec
 VELOCITY_CMD_DURATION = 0.6  # seconds
 COMMAND_INPUT_RATE = 0.1
+ROBOT_STATE_TIMEOUT = 10.0  # seconds to wait for the first robot state
+
+# Enum value -> display name with the common prefix stripped, built once instead of per draw
+_POWER_STATE_NAMES = {
+    value: name[6:]  # get rid of STATE_ prefix
+    for name, value in robot_state_proto.PowerState.MotorPowerState.items()}
+_ESTOP_STATE_NAMES = {
+    value: name[6:]  # get rid of STATE_ prefix
+    for name, value in robot_state_proto.EStopState.State.items()}
+_BATTERY_STATUS_NAMES = {
+    value: name[7:]  # get rid of STATUS_ prefix
+    for name, value in robot_state_proto.BatteryState.Status.items()}
+# Static command help, drawn with one addstr starting at row 10
+_HELP_TEXT = ('Commands: [TAB]: quit\n'
+              '          [T]: Time-sync, [SPACE]: Estop, [P]: Power\n'
+              '          [I]: Take image, [O]: Video mode\n'
+              '          [f]: Stand, [r]: Self-right\n'
+              '          [v]: Sit, [b]: Battery-change\n'
+              '          [wasd]: Directional strafing\n'
+              '          [qe]: Turning, [ESC]: Stop\n'
+              '          [l]: Return/Acquire lease')
+# Battery bar for each 10% step of charge
+_BATTERY_BARS = tuple(f'|{"=" * i}{" " * (10 - i)}|' for i in range(11))
 
 def _grpc_or_log(desc, thunk):
     try:
@@ -68,11 +92,13 @@ class EMGInterface(object):
         self._power_client = robot.ensure_client(PowerClient.default_service_name)
         self._robot_state_client = robot.ensure_client(RobotStateClient.default_service_name)
         self._robot_command_client = robot.ensure_client(RobotCommandClient.default_service_name)
+        # Bound once, this is looked up on every key press
+        self._send_cmd = self._robot_command_client.robot_command_async
         self._robot_state_task = AsyncRobotState(self._robot_state_client)
         
         self._async_tasks = AsyncTasks([self._robot_state_task])
         self._lock = threading.Lock()
-        self._command_dictionary = {
+        command_dictionary = {
             27: self._stop,  # ESC key
             ord('\t'): self._quit_program,
             ord('T'): self._toggle_time_sync,
@@ -93,12 +119,46 @@ class EMGInterface(object):
             ord('j'): self._stow,
             ord('l'): self._toggle_lease
         }
+        # (v_x, v_y, v_rot) contributed by each velocity key, summed by _drive_cmds
+        velocity_keys = {
+            ord('w'): (VELOCITY_BASE_SPEED, 0.0, 0.0),
+            ord('s'): (-VELOCITY_BASE_SPEED, 0.0, 0.0),
+            ord('a'): (0.0, VELOCITY_BASE_SPEED, 0.0),
+            ord('d'): (0.0, -VELOCITY_BASE_SPEED, 0.0),
+            ord('q'): (0.0, 0.0, VELOCITY_BASE_ANGULAR),
+            ord('e'): (0.0, 0.0, -VELOCITY_BASE_ANGULAR),
+        }
+        # Key codes are below 256, so index flat tables directly instead of hashing
+        self._command_table = [None] * 256
+        for key, cmd_function in command_dictionary.items():
+            self._command_table[key] = cmd_function
+        self._velocity_table = [None] * 256
+        for key, velocity in velocity_keys.items():
+            self._velocity_table[key] = velocity
+        # Commands without parameters are built once and resent as is
+        self._cmd_self_right = RobotCommandBuilder.selfright_command()
+        # Default HINT_RIGHT, maybe add option to choose direction?
+        self._cmd_battery_change_pose = RobotCommandBuilder.battery_change_pose_command(
+            dir_hint=basic_command_pb2.BatteryChangePoseCommand.Request.HINT_RIGHT)
+        self._cmd_sit = RobotCommandBuilder.synchro_sit_command()
+        self._cmd_stand = RobotCommandBuilder.synchro_stand_command()
+        self._cmd_stop = RobotCommandBuilder.stop_command()
+        self._cmd_stow = RobotCommandBuilder.arm_stow_command()
+        self._cmd_unstow = RobotCommandBuilder.arm_ready_command()
+        self._cmd_safe_power_off = RobotCommandBuilder.safe_power_off_command()
+        # Velocity command protos by (v_x, v_y, v_rot), built once and reused for every send
+        self._velocity_commands = {}
+        for velocity in velocity_keys.values():
+            self._velocity_command(*velocity)
         self._locked_messages = ['', '', '']  # string: displayed message for user
+        self._row_cache = [''] * 26  # string: text last drawn on each screen row
+        self._sw_estop_idx = None  # int: index of the software estop in estop_states
         self._estop_keepalive = None
         self._exit_check = None
 
         # Stuff that is set in start()
         self._robot_id = None
+        self._header = ''
         self._lease_keepalive = None
 
     def start(self):
@@ -108,6 +168,8 @@ class EMGInterface(object):
                                                return_at_exit=True)
 
         self._robot_id = self._robot.get_id()
+        # The robot id does not change, so format the screen header once
+        self._header = f'{self._robot_id.nickname:20s} {self._robot_id.serial_number}'
         if self._estop_endpoint is not None:
             self._estop_endpoint.force_simple_setup(
             )  # Set this endpoint as the robot's sole estop.
@@ -124,7 +186,11 @@ class EMGInterface(object):
     @property
     def robot_state(self):
         """Get latest robot state proto."""
-        return self._robot_state_client.get_robot_state()
+        return self._robot_state_task.proto
+
+    def update(self):
+        """Poll the async tasks, refreshing the cached robot state."""
+        self._async_tasks.update()
 
     # def drive(self, stdscr):
     #     """User interface to control the robot via the passed-in curses screen interface object."""
@@ -146,10 +212,13 @@ class EMGInterface(object):
     #                 self._drive_draw(stdscr, self._lease_keepalive)
 
     #                 try:
-    #                     cmd = stdscr.getch()
-    #                     # Do not queue up commands on client
-    #                     self.flush_and_estop_buffer(stdscr)
-    #                     self._drive_cmd(cmd)
+    #                     # Take every key pressed since the last tick, one command goes out
+    #                     keys = []
+    #                     key = stdscr.getch()
+    #                     while key != -1:
+    #                         keys.append(key)
+    #                         key = stdscr.getch()
+    #                     self._drive_cmds(keys)
     #                     time.sleep(COMMAND_INPUT_RATE)
     #                 except Exception:
     #                     # On robot command fault, sit down safely before killing the program.
@@ -161,26 +230,19 @@ class EMGInterface(object):
     #             LOGGER.removeHandler(curses_handler)
 
     # def _drive_draw(self, stdscr, lease_keep_alive):
-    #     """Draw the interface screen at each update."""
-    #     stdscr.clear()  # clear screen
-    #     stdscr.resize(26, 140)
-    #     stdscr.addstr(0, 0, f'{self._robot_id.nickname:20s} {self._robot_id.serial_number}')
-    #     stdscr.addstr(1, 0, self._lease_str(lease_keep_alive))
-    #     stdscr.addstr(2, 0, self._battery_str())
-    #     stdscr.addstr(3, 0, self._estop_str())
-    #     stdscr.addstr(4, 0, self._power_state_str())
-    #     stdscr.addstr(5, 0, self._time_sync_str())
+    #     """Draw the interface screen at each update, rewriting only the rows that changed."""
+    #     self._draw_row(stdscr, 0, self._header)
+    #     with self._lock:
+    #         state = self.robot_state
+    #     self._draw_row(stdscr, 1, self._lease_str(lease_keep_alive))
+    #     self._draw_row(stdscr, 2, self._battery_str(state))
+    #     self._draw_row(stdscr, 3, self._estop_str(state))
+    #     self._draw_row(stdscr, 4, self._power_state_str(state))
+    #     self._draw_row(stdscr, 5, self._time_sync_str())
     #     for i in range(3):
-    #         stdscr.addstr(7 + i, 2, self.message(i))
-    #     stdscr.addstr(10, 0, 'Commands: [TAB]: quit                               ')
-    #     stdscr.addstr(11, 0, '          [T]: Time-sync, [SPACE]: Estop, [P]: Power')
-    #     stdscr.addstr(12, 0, '          [I]: Take image, [O]: Video mode          ')
-    #     stdscr.addstr(13, 0, '          [f]: Stand, [r]: Self-right               ')
-    #     stdscr.addstr(14, 0, '          [v]: Sit, [b]: Battery-change             ')
-    #     stdscr.addstr(15, 0, '          [wasd]: Directional strafing              ')
-    #     stdscr.addstr(16, 0, '          [qe]: Turning, [ESC]: Stop                ')
-    #     stdscr.addstr(17, 0, '          [l]: Return/Acquire lease                 ')
-    #     stdscr.addstr(18, 0, '')
+    #         self._draw_row(stdscr, 7 + i, self.message(i), col=2)
+    #     # Rows 10-17, curses moves to the next row at each embedded newline
+    #     self._draw_row(stdscr, 10, _HELP_TEXT)
 
     #     # print as many lines of the image as will fit on the curses screen
     #     if self._image_task.ascii_image is not None:
@@ -189,20 +251,54 @@ class EMGInterface(object):
     #             if y_i + 17 >= max_y:
     #                 break
 
-    #             stdscr.addstr(y_i + 17, 0, img_line)
+    #             self._draw_row(stdscr, y_i + 17, img_line)
+
+    #     stdscr.noutrefresh()
+    #     curses.doupdate()
 
-    #     stdscr.refresh()
+    def _draw_row(self, stdscr, row, text, col=0):
+        """Write one screen row, skipping the curses calls if it is unchanged since last draw."""
+        if self._row_cache[row] == text:
+            return
+        stdscr.move(row, 0)
+        stdscr.clrtoeol()
+        stdscr.addstr(row, col, text)
+        self._row_cache[row] = text
 
     def _drive_cmd(self, key):
         """Run user commands at each update."""
-        try:
-            cmd_function = self._command_dictionary[key]
-            cmd_function()
-
-        except KeyError:
-            if key and key != -1 and key < 256:
+        if 0 <= key < 256:
+            cmd_function = self._command_table[key]
+            if cmd_function is not None:
+                cmd_function()
+            elif key:
                 print(f'Unrecognized keyboard command: \'{chr(key)}\'')
 
+    def _drive_cmds(self, keys):
+        """Run all user commands from one update, sending a single combined velocity command."""
+        v_x = v_y = v_rot = 0.0
+        moved = False
+        others = []
+        # Each distinct key counts once, so keyboard auto-repeat cannot multiply the speed
+        keys = dict.fromkeys(keys)
+        # Like flush_and_estop_buffer in wasd.py, estop goes out before any motion command
+        if ord(' ') in keys:
+            del keys[ord(' ')]
+            self._toggle_estop()
+        for key in keys:
+            velocity = self._velocity_table[key] if 0 <= key < 256 else None
+            if velocity is None:
+                others.append(key)
+            else:
+                moved = True
+                v_x += velocity[0]
+                v_y += velocity[1]
+                v_rot += velocity[2]
+        if moved:
+            self._velocity_cmd_helper('combined', v_x=v_x, v_y=v_y, v_rot=v_rot)
+        for key in others:
+            self._drive_cmd(key)
+
     def _try_grpc(self, desc, thunk):
         try:
             return thunk()
@@ -219,11 +315,16 @@ class EMGInterface(object):
                 print(f'Failed {desc}: {err}')
                 return None
 
-        future = thunk()
+        try:
+            # The lease and time-sync processing runs before the future exists
+            future = thunk()
+        except (ResponseError, RpcError, LeaseBaseError) as err:
+            print(f'Failed {desc}: {err}')
+            return None
         future.add_done_callback(on_future_done)
 
     def _quit_program(self):
-        self._sit()
+        self._sit(wait=True)
         if self._exit_check is not None:
             self._exit_check.request_exit()
 
@@ -253,29 +354,33 @@ class EMGInterface(object):
                 self._lease_keepalive.shutdown()
                 self._lease_keepalive = None
 
-    def _start_robot_command(self, desc, command_proto, end_time_secs=None):
+    def _start_robot_command(self, desc, command_proto, end_time_secs=None, wait=False):
+        """Send a robot command without waiting for the ack, unless wait is set."""
+        if wait:
+
+            def _start_command():
+                self._robot_command_client.robot_command(command=command_proto,
+                                                         end_time_secs=end_time_secs)
 
-        def _start_command():
-            self._robot_command_client.robot_command(command=command_proto,
-                                                     end_time_secs=end_time_secs)
+            self._try_grpc(desc, _start_command)
+            return
 
-        self._try_grpc(desc, _start_command)
+        def _start_command_async():
+            return self._send_cmd(command=command_proto, end_time_secs=end_time_secs)
+
+        self._try_grpc_async(desc, _start_command_async)
 
     def _self_right(self):
-        self._start_robot_command('self_right', RobotCommandBuilder.selfright_command())
+        self._start_robot_command('self_right', self._cmd_self_right)
 
     def _battery_change_pose(self):
-        # Default HINT_RIGHT, maybe add option to choose direction?
-        self._start_robot_command(
-            'battery_change_pose',
-            RobotCommandBuilder.battery_change_pose_command(
-                dir_hint=basic_command_pb2.BatteryChangePoseCommand.Request.HINT_RIGHT))
+        self._start_robot_command('battery_change_pose', self._cmd_battery_change_pose)
 
-    def _sit(self):
-        self._start_robot_command('sit', RobotCommandBuilder.synchro_sit_command())
+    def _sit(self, wait=False):
+        self._start_robot_command('sit', self._cmd_sit, wait=wait)
 
     def _stand(self):
-        self._start_robot_command('stand', RobotCommandBuilder.synchro_stand_command())
+        self._start_robot_command('stand', self._cmd_stand)
 
     def _move_forward(self):
         self._velocity_cmd_helper('move_forward', v_x=VELOCITY_BASE_SPEED)
@@ -296,18 +401,28 @@ class EMGInterface(object):
         self._velocity_cmd_helper('turn_right', v_rot=-VELOCITY_BASE_ANGULAR)
 
     def _stop(self):
-        self._start_robot_command('stop', RobotCommandBuilder.stop_command())
-
-    def _velocity_cmd_helper(self, desc='', v_x=0.0, v_y=0.0, v_rot=0.0):
-        self._start_robot_command(
-            desc, RobotCommandBuilder.synchro_velocity_command(v_x=v_x, v_y=v_y, v_rot=v_rot),
-            end_time_secs=time.time() + VELOCITY_CMD_DURATION)
+        self._start_robot_command('stop', self._cmd_stop)
+
+    def _velocity_command(self, v_x, v_y, v_rot):
+        key = (v_x, v_y, v_rot)
+        command = self._velocity_commands.get(key)
+        if command is None:
+            command = RobotCommandBuilder.synchro_velocity_command(v_x=v_x, v_y=v_y, v_rot=v_rot)
+            self._velocity_commands[key] = command
+        return command
+
+    def _velocity_cmd_helper(self, desc='', v_x=0.0, v_y=0.0, v_rot=0.0, _time=time.time,
+                             _duration=VELOCITY_CMD_DURATION):
+        # The deadline goes on the request, so the cached command proto is never modified.
+        # Wall-clock time is needed here, the client converts it with the robot time sync.
+        self._start_robot_command(desc, self._velocity_command(v_x, v_y, v_rot),
+                                  end_time_secs=_time() + _duration)
 
     def _stow(self):
-        self._start_robot_command('stow', RobotCommandBuilder.arm_stow_command())
+        self._start_robot_command('stow', self._cmd_stow)
 
     def _unstow(self):
-        self._start_robot_command('stow', RobotCommandBuilder.arm_ready_command())
+        self._start_robot_command('stow', self._cmd_unstow)
 
     def _return_to_origin(self):
         self._start_robot_command(
@@ -333,10 +448,12 @@ class EMGInterface(object):
         return self._power_client.power_command_async(request)
 
     def _safe_power_off(self):
-        self._start_robot_command('safe_power_off', RobotCommandBuilder.safe_power_off_command())
+        # Kept blocking, this also runs from the fault handler right before exiting
+        self._start_robot_command('safe_power_off', self._cmd_safe_power_off, wait=True)
 
-    def _power_state(self):
-        state = self.robot_state
+    def _power_state(self, state=None):
+        if state is None:
+            state = self.robot_state
         if not state:
             return None
         return state.power_state.motor_power_state
@@ -357,27 +474,37 @@ class EMGInterface(object):
                 alive = 'STOPPED'
         return f'Lease {lease} THREAD:{alive}'
 
-    def _power_state_str(self):
-        power_state = self._power_state()
+    def _power_state_str(self, state):
+        power_state = self._power_state(state)
         if power_state is None:
             return ''
-        state_str = robot_state_proto.PowerState.MotorPowerState.Name(power_state)
-        return f'Power: {state_str[6:]}'  # get rid of STATE_ prefix
+        return f'Power: {_POWER_STATE_NAMES.get(power_state, "??")}'
 
-    def _estop_str(self):
+    def _estop_str(self, state):
         if not self._estop_client:
             thread_status = 'NOT ESTOP'
         else:
             thread_status = 'RUNNING' if self._estop_keepalive else 'STOPPED'
         estop_status = '??'
-        state = self.robot_state
         if state:
-            for estop_state in state.estop_states:
-                if estop_state.type == estop_state.TYPE_SOFTWARE:
-                    estop_status = estop_state.State.Name(estop_state.state)[6:]  # s/STATE_//
-                    break
+            estop_state = self._software_estop_state(state)
+            if estop_state is not None:
+                estop_status = _ESTOP_STATE_NAMES.get(estop_state.state, '??')
         return f'Estop {estop_status} (thread: {thread_status})'
 
+    def _software_estop_state(self, state):
+        """Find the software estop entry, reusing its index from the last state if still valid."""
+        estop_states = state.estop_states
+        idx = self._sw_estop_idx
+        if (idx is not None and idx < len(estop_states) and
+                estop_states[idx].type == robot_state_proto.EStopState.TYPE_SOFTWARE):
+            return estop_states[idx]
+        for idx, estop_state in enumerate(estop_states):
+            if estop_state.type == robot_state_proto.EStopState.TYPE_SOFTWARE:
+                self._sw_estop_idx = idx
+                return estop_state
+        return None
+
     def _time_sync_str(self):
         if not self._robot.time_sync:
             return 'Time sync: (none)'
@@ -398,17 +525,13 @@ class EMGInterface(object):
             skew_str = f'({err})'
         return f'Time sync: {status} {skew_str}'
 
-    def _battery_str(self):
-        if not self.robot_state:
+    def _battery_str(self, state):
+        if not state:
             return ''
-        battery_state = self.robot_state.battery_states[0]
-        status = battery_state.Status.Name(battery_state.status)
-        status = status[7:]  # get rid of STATUS_ prefix
-        if battery_state.charge_percentage.value:
-            bar_len = int(battery_state.charge_percentage.value) // 10
-            bat_bar = f'|{"=" * bar_len}{" " * (10 - bar_len)}|'
-        else:
-            bat_bar = ''
+        battery_state = state.battery_states[0]
+        status = _BATTERY_STATUS_NAMES.get(battery_state.status, '??')
+        charge = battery_state.charge_percentage.value
+        bat_bar = _BATTERY_BARS[min(int(charge) // 10, 10)] if charge else ''
         time_left = ''
         if battery_state.estimated_runtime:
             time_left = f'({secs_to_hms(battery_state.estimated_runtime.seconds)})'
@@ -434,14 +557,24 @@ def main():
         LOGGER.error('Failed to initialize robot communication: %s', err)
         return False
 
+    # Power and estop checks read the cached state, so wait for the first one to arrive
+    deadline = time.time() + ROBOT_STATE_TIMEOUT
+    while wasd_interface.robot_state is None:
+        if time.time() > deadline:
+            LOGGER.error('No robot state received within %.0f s', ROBOT_STATE_TIMEOUT)
+            return False
+        wasd_interface.update()
+        time.sleep(COMMAND_INPUT_RATE)
+
     s = socket.socket()
     port = 5000
     s.connect(('127.0.0.1', port))
-        
+    s_reader = s.makefile('rb')
+    get_cmd_request = encode_frame(GET_CMD)
+
     def getcommandfromserver():
-        s.send("get_cmd".encode())
-        msg = s.recv(1024).decode()
-        return msg
+        s.sendall(get_cmd_request)
+        return read_frame_blocking(s_reader).decode()
     
     print(getcommandfromserver())
     
@@ -454,7 +587,8 @@ def main():
 
     start = time.time()
     while True:
-        
+        wasd_interface.update()
+
         command = getcommandfromserver()
 
         match command:
@@ -469,14 +603,15 @@ def main():
             case 'finish':
                 break
             case _:
-                continue
+                # 'none' is the idle reply, still pace the loop and check the timeout
+                pass
 
         if time.time() - start > 700:
             break
 
         time.sleep(0.2)
     
-    wasd_interface._sit()
+    wasd_interface._sit(wait=True)
     return True
 
 